@@ -1,18 +1,140 @@
-from typing import List, Dict, Optional
-from groq import Groq
-from prompts import Prompts
+from typing import List, Dict, Optional, Union, Protocol, Tuple, Iterable, Iterator
+from pathlib import Path
+from groq import Groq, APIStatusError, APIConnectionError
+from rapidfuzz import fuzz
+from prompts import Prompts, PromptTemplate
 import logging
 from dataclasses import dataclass
 from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import threading
+import hashlib
+import random
+import time
+import bisect
+import re
+import sqlite3
 import json
+import orjson
+
+MODEL = "llama-3.1-70b-versatile"
+
+_PARAGRAPH_RE = re.compile(r'(?=\n\n)')
+_SENTENCE_RE = re.compile(r'\. ')
+_LINE_RE = re.compile(r'\n')
+_SENTENCE_SPLIT_RE = re.compile(r'(?<=[.!?])\s+')
+_TITLE_PHRASE_RE = re.compile(r'\b[A-Z][a-z]+(?:\s+[A-Z][a-z]+)+\b')
+_VALIDATION_RE = re.compile(r'INDEX:\s*(\d+)\s*,\s*VALID:\s*(true|false)', re.IGNORECASE)
+
+# Templates are parsed once at import instead of on every format call
+_QA_GENERATION = PromptTemplate(Prompts.QA_GENERATION)
+_CONTEXT_INSTRUCTION = PromptTemplate(Prompts.CONTEXT_INSTRUCTION)
+_OVERLAP_INSTRUCTION = PromptTemplate(Prompts.OVERLAP_INSTRUCTION)
+_ERROR_RECOVERY = PromptTemplate(Prompts.ERROR_RECOVERY)
+_VALIDATION = PromptTemplate(Prompts.VALIDATION)
+_CHUNK_SUMMARY = PromptTemplate(Prompts.CHUNK_SUMMARY)
 
 @dataclass
 class QAPair:
     question: str
     answer: str
-    confidence: float = 1.0
+    confidence: Optional[float] = None  # Unscored until LLM validation runs
     metadata: Dict = None
 
+class CacheBackend(Protocol):
+    """Storage used by LLMCache to persist raw completions"""
+
+    def get(self, key: str) -> Optional[str]:
+        ...
+
+    def set(self, key: str, value: str) -> None:
+        ...
+
+class InMemoryCacheBackend:
+    """Process-local cache backend"""
+    
+    def __init__(self):
+        self._store: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            return self._store.get(key)
+
+    def set(self, key: str, value: str) -> None:
+        with self._lock:
+            self._store[key] = value
+
+class SQLiteCacheBackend:
+    """Cache backend persisted to a SQLite file so it survives across runs"""
+    
+    def __init__(self, path: Union[str, Path]):
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+            )
+            self._conn.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, value: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value) VALUES (?, ?)", (key, value)
+            )
+            self._conn.commit()
+
+class LLMCache:
+    """Exact-match cache of LLM completions keyed on (model, prompt)"""
+    
+    def __init__(self, backend: Optional[CacheBackend] = None):
+        self.backend = backend if backend is not None else InMemoryCacheBackend()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(model: str, prompt: str) -> str:
+        """Build a stable cache key for a model/prompt combination"""
+        payload = json.dumps({"model": model, "prompt": prompt}, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        value = self.backend.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key: str, value: str) -> None:
+        self.backend.set(key, value)
+
+class RateLimiter:
+    """Spaces out request starts across threads to stay under a requests-per-minute quota"""
+    
+    def __init__(self, rpm: int):
+        self._interval = 60.0 / rpm
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Block until the caller may start its next request"""
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self._interval
+        if wait > 0:
+            time.sleep(wait)
+
 class TextProcessingAgent:
     """Agent responsible for processing and chunking text"""
     
@@ -22,210 +144,315 @@ class TextProcessingAgent:
         self.logger = logging.getLogger(__name__)
 
     def create_chunks(self, text: str) -> List[str]:
-        """Split text into overlapping chunks with intelligent break points"""
-        chunks = []
+        """
+        Split text into consecutive, non-overlapping chunks with intelligent
+        break points. The overlap is supplied separately as preceding context
+        so it is never sent to the model as content twice.
+        """
+        spans, _ = self._split(text, final=True)
+        self.logger.info("Created %d chunks from text", len(spans))
+        return [text[start:end] for start, end in spans]
+
+    def iter_chunks(self, blocks: Iterable[str]) -> Iterator[str]:
+        """
+        Lazily chunk a stream of text blocks, e.g. fixed-size file reads or
+        PDF pages, holding at most one chunk of unconsumed text between blocks.
+        Yields the text of the chunks create_chunks would find in the
+        concatenated blocks.
+        """
+        buffer = ""
+        count = 0
+        
+        for block in blocks:
+            buffer += block
+            spans, consumed = self._split(buffer, final=False)
+            count += len(spans)
+            for start, end in spans:
+                yield buffer[start:end]
+            buffer = buffer[consumed:]
+        
+        spans, _ = self._split(buffer, final=True)
+        count += len(spans)
+        for start, end in spans:
+            yield buffer[start:end]
+        
+        self.logger.info("Created %d chunks from text", count)
+
+    def _split(self, text: str, final: bool) -> Tuple[List[Tuple[int, int]], int]:
+        """
+        Chunk text and return the chunk spans along with how much of it was consumed.
+        Unless final, stops once less than a full chunk remains, since the best
+        break point for that chunk may lie in text that has not been read yet.
+        """
+        spans = []
         start = 0
         
+        # Locate natural break points once, in order of preference
+        separators = [
+            ([m.start() for m in _PARAGRAPH_RE.finditer(text)], 2),
+            ([m.start() for m in _SENTENCE_RE.finditer(text)], 2),
+            ([m.start() for m in _LINE_RE.finditer(text)], 1)
+        ]
+        
         while start < len(text):
             end = start + self.chunk_size
             
             if end < len(text):
-                # Find natural break points
-                break_candidates = {
-                    text[start:end].rfind('\n\n'): 'paragraph',
-                    text[start:end].rfind('. '): 'sentence',
-                    text[start:end].rfind('\n'): 'line'
-                }
-                
-                # Choose the best break point
-                break_point = max(point for point in break_candidates.keys() if point != -1)
-                if break_point != -1:
-                    end = start + break_point + 1
+                # Only accept breaks that still move the next chunk forward
+                break_point = self._find_break(separators, start + 1, end)
+                if break_point is not None:
+                    end = break_point + 1
+            elif not final:
+                break
             
-            chunk = text[start:end].strip()
-            if chunk:  # Only add non-empty chunks
-                chunks.append(chunk)
+            # Trim surrounding whitespace by moving the bounds instead of copying
+            lo, hi = start, min(end, len(text))
+            while lo < hi and text[lo].isspace():
+                lo += 1
+            while hi > lo and text[hi - 1].isspace():
+                hi -= 1
+            if lo < hi:  # Only add non-empty chunks
+                spans.append((lo, hi))
             
-            start = end - self.overlap
+            start = end
         
-        self.logger.info(f"Created {len(chunks)} chunks from text")
-        return chunks
+        return spans, start
+
+    @staticmethod
+    def _find_break(separators: List[Tuple[List[int], int]], 
+                    lo: int, 
+                    hi: int) -> Optional[int]:
+        """Return the rightmost separator within [lo, hi) of the most preferred kind"""
+        for positions, width in separators:
+            i = bisect.bisect_right(positions, hi - width) - 1
+            if i >= 0 and positions[i] >= lo:
+                return positions[i]
+        return None
 
 class QAGenerationAgent:
     """Agent responsible for generating QA pairs using Groq API"""
     
-    def __init__(self, api_key: str):
-        self.client = Groq(api_key=api_key)
+    def __init__(self, 
+                 client: Groq, 
+                 cache: Optional[LLMCache] = None,
+                 rate_limiter: Optional[RateLimiter] = None):
+        self.client = client
+        # Retries go through generate_qa_pairs' own backoff and rate limiter
+        self._completions = client.with_options(max_retries=0).chat.completions
+        self.cache = cache
+        self.rate_limiter = rate_limiter
         self.logger = logging.getLogger(__name__)
+        # Shared by every pair this agent creates; treat as read-only
+        self.metadata = {'source_type': MODEL}
 
     def generate_qa_pairs(self, 
                          chunk: str, 
                          context: Optional[str] = None,
+                         overlap_prefix: Optional[str] = None,
                          retry_count: int = 2) -> List[QAPair]:
-        """Generate QA pairs from a text chunk"""
-        context_instruction = Prompts.CONTEXT_INSTRUCTION.format(context=context) if context else ""
-        prompt = Prompts.QA_GENERATION.format(
+        """Generate QA pairs from a text chunk, using any preceding text only as context"""
+        context_instruction = _CONTEXT_INSTRUCTION.format(context=context) if context else ""
+        if overlap_prefix:
+            context_instruction += _OVERLAP_INSTRUCTION.format(overlap_text=overlap_prefix)
+        prompt = _QA_GENERATION.format(
             text_content=chunk,
             context_instruction=context_instruction
         )
 
         for attempt in range(retry_count + 1):
             try:
-                response = self.client.chat.completions.create(
-                    messages=[{
-                        "role": "user",
-                        "content": prompt
-                    }],
-                    model="llama-3.1-70b-versatile"
-                )
+                key = LLMCache.make_key(MODEL, prompt)
+                content = self.cache.get(key) if self.cache else None
+                cached = content is not None
+                
+                if not cached:
+                    if self.rate_limiter:
+                        self.rate_limiter.acquire()
+                    response = self._completions.create(
+                        messages=[{
+                            "role": "user",
+                            "content": prompt
+                        }],
+                        model=MODEL,
+                        response_format={"type": "json_object"}
+                    )
+                    content = response.choices[0].message.content
+                
+                qa_pairs = self._parse_qa_response(content)
+                
+                # Only cache responses that parsed cleanly
+                if self.cache and not cached:
+                    self.cache.set(key, content)
+                
+                return qa_pairs
                 
-                return self._parse_qa_response(response.choices[0].message.content)
+            except (APIStatusError, APIConnectionError) as e:
+                # Client errors other than rate limiting will not succeed on retry
+                if isinstance(e, APIStatusError) and e.status_code < 500 and e.status_code != 429:
+                    self.logger.error("Request rejected, not retrying: %s", e)
+                    return []
+                self.logger.error("Attempt %d failed: %s", attempt + 1, e)
+                if attempt == retry_count:
+                    self.logger.error("All attempts failed")
+                    return []
+                time.sleep(min(2 ** attempt + random.random(), 30))
                 
             except Exception as e:
-                self.logger.error(f"Attempt {attempt + 1} failed: {str(e)}")
+                self.logger.error("Attempt %d failed: %s", attempt + 1, e)
                 if attempt == retry_count:
                     self.logger.error("All attempts failed")
                     return []
-                prompt = Prompts.ERROR_RECOVERY.format(
+                prompt = _ERROR_RECOVERY.format(
                     text_content=chunk,
                     context_instruction=context_instruction
                 )
 
     def _parse_qa_response(self, response_text: str) -> List[QAPair]:
-        """Parse the response text into QA pairs with robust error checking"""
-        qa_pairs = []
-        lines = [line.strip() for line in response_text.strip().split('\n') if line.strip()]
-        
-        current_question = None
-        current_answer = None
-        
-        for line in lines:
-            # Skip empty lines
-            if not line:
-                continue
-                
-            # Check if line starts with Q or A
-            if line.startswith(('Q1:', 'Q2:', 'Q3:', 'Q:', 'Question:')):
-                # If we have a complete pair, add it before starting new question
-                if current_question is not None and current_answer is not None:
-                    qa_pairs.append(QAPair(
-                        question=current_question,
-                        answer=current_answer,
-                        metadata={'source_type': 'groq_llama2'}
-                    ))
-                
-                # Start new question
-                current_question = line.split(':', 1)[1].strip()
-                current_answer = None
-                
-            elif line.startswith(('A1:', 'A2:', 'A3:', 'A:', 'Answer:')):
-                current_answer = line.split(':', 1)[1].strip()
-                
-                # If we have both Q&A, add the pair
-                if current_question is not None and current_answer is not None:
-                    qa_pairs.append(QAPair(
-                        question=current_question,
-                        answer=current_answer,
-                        metadata={'source_type': 'groq_llama2'}
-                    ))
-                    current_question = None
-                    current_answer = None
-        
-        # Handle any remaining complete pair
-        if current_question is not None and current_answer is not None:
-            qa_pairs.append(QAPair(
-                question=current_question,
-                answer=current_answer,
-                metadata={'source_type': 'llama-3.1-70b-versatile'}
-            ))
+        """Parse a JSON mode response into QA pairs, skipping empty or non-string entries"""
+        pairs = orjson.loads(response_text).get('pairs', [])
         
-        # Validate pairs before returning
-        validated_pairs = []
-        for pair in qa_pairs:
-            if pair.question and pair.answer and \
-               len(pair.question.strip()) > 0 and len(pair.answer.strip()) > 0:
-                validated_pairs.append(pair)
+        qa_pairs = [
+            QAPair(
+                question=(item.get('q') or '').strip(),
+                answer=(item.get('a') or '').strip(),
+                metadata=self.metadata
+            )
+            for item in pairs
+            if isinstance(item, dict)
+            and isinstance(item.get('q') or '', str)
+            and isinstance(item.get('a') or '', str)
+        ]
         
-        return validated_pairs
+        return [pair for pair in qa_pairs if pair.question and pair.answer]
 
 class ValidationAgent:
     """Agent responsible for validating generated QA pairs"""
     
-    def __init__(self, api_key: str):
-        self.client = Groq(api_key=api_key)
+    def __init__(self, 
+                 client: Groq, 
+                 cache: Optional[LLMCache] = None,
+                 rate_limiter: Optional[RateLimiter] = None):
+        self.client = client
+        self.cache = cache
+        self.rate_limiter = rate_limiter
         self.logger = logging.getLogger(__name__)
 
+    def filter_qa_pairs(self, qa_pairs: List[QAPair]) -> List[QAPair]:
+        """Drop QA pairs that fail cheap local quality checks, without an API call"""
+        return [
+            pair for pair in qa_pairs
+            if len(pair.answer) >= 10
+            and pair.question.endswith('?')
+            and fuzz.ratio(pair.question, pair.answer) <= 80
+        ]
+
     def validate_qa_pairs(self, qa_pairs: List[QAPair]) -> List[QAPair]:
-        """Validate a list of QA pairs"""
+        """Validate a list of QA pairs in a single request"""
+        if not qa_pairs:
+            return qa_pairs
+        
         qa_text = "\n".join([
-            f"Q: {pair.question}\nA: {pair.answer}"
-            for pair in qa_pairs
+            f"INDEX: {i}\nQ: {pair.question}\nA: {pair.answer}"
+            for i, pair in enumerate(qa_pairs, 1)
         ])
         
-        prompt = Prompts.VALIDATION.format(qa_pairs=qa_text)
+        prompt = _VALIDATION.format(qa_pairs=qa_text)
         
         try:
-            response = self.client.chat.completions.create(
-                messages=[{
-                    "role": "user",
-                    "content": prompt
-                }],
-                model="llama-3.1-70b-versatile"
-            )
+            key = LLMCache.make_key(MODEL, prompt)
+            feedback = self.cache.get(key) if self.cache else None
+            cached = feedback is not None
             
-            feedback = response.choices[0].message.content
-            return self._apply_validation_feedback(qa_pairs, feedback)
+            if not cached:
+                if self.rate_limiter:
+                    self.rate_limiter.acquire()
+                response = self.client.chat.completions.create(
+                    messages=[{
+                        "role": "user",
+                        "content": prompt
+                    }],
+                    model=MODEL
+                )
+                feedback = response.choices[0].message.content
+            
+            verdicts = self._parse_verdicts(feedback)
+            
+            # Only cache responses that contained at least one verdict
+            if self.cache and not cached and verdicts:
+                self.cache.set(key, feedback)
+            
+            return self._apply_validation_feedback(qa_pairs, verdicts)
             
         except Exception as e:
-            self.logger.error(f"Validation failed: {str(e)}")
+            self.logger.error("Validation failed: %s", e)
+            # Mark the batch as unverified rather than leaving it unscored
+            for pair in qa_pairs:
+                pair.confidence = 0.5
             return qa_pairs
 
+    @staticmethod
+    def _parse_verdicts(feedback: str) -> Dict[int, bool]:
+        """Extract per-index VALID verdicts from validation feedback"""
+        return {
+            int(index): valid.lower() == 'true'
+            for index, valid in _VALIDATION_RE.findall(feedback)
+        }
+
     def _apply_validation_feedback(self, 
                                  qa_pairs: List[QAPair], 
-                                 feedback: str) -> List[QAPair]:
-        """Apply validation feedback to QA pairs"""
-        # Simple validation - check if feedback suggests the pair is valid
-        validated_pairs = []
+                                 verdicts: Dict[int, bool]) -> List[QAPair]:
+        """Apply per-index validation verdicts to QA pairs"""
+        # Pairs the validator did not mention are treated as unverified
+        for i, pair in enumerate(qa_pairs, 1):
+            pair.confidence = 1.0 if verdicts.get(i) else 0.5
         
-        for pair in qa_pairs:
-            if "VALID: true" in feedback.lower():
-                pair.confidence = 1.0
-            else:
-                pair.confidence = 0.5
-            validated_pairs.append(pair)
-        
-        return validated_pairs
+        return qa_pairs
 
 class ContextManager:
     """Agent responsible for managing context between chunks"""
     
-    def __init__(self, api_key: str):
-        self.client = Groq(api_key=api_key)
+    def __init__(self, 
+                 client: Groq, 
+                 rate_limiter: Optional[RateLimiter] = None,
+                 use_llm: bool = False):
+        self.client = client
+        self.rate_limiter = rate_limiter
+        self.use_llm = use_llm  # Summarize with the LLM instead of locally
         self.logger = logging.getLogger(__name__)
-        self.context_history = []
+        self.context_history = deque(maxlen=3)  # Keep only recent context
 
-    def update_context(self, chunk: str) -> str:
-        """Generate and update context from a chunk"""
-        prompt = Prompts.CHUNK_SUMMARY.format(chunk_text=chunk)
+    def summarize_chunk(self, chunk: str) -> str:
+        """Summarize a single chunk without touching the context history"""
+        if not self.use_llm:
+            return self._extractive_summary(chunk)
         
-        try:
-            response = self.client.chat.completions.create(
-                messages=[{
-                    "role": "user",
-                    "content": prompt
-                }],
-                model="llama-3.1-70b-versatile"
-            )
-            
-            summary = response.choices[0].message.content
-            self.context_history.append(summary)
-            
-            # Keep only recent context
-            if len(self.context_history) > 3:
-                self.context_history.pop(0)
-            
-            return " ".join(self.context_history)
-            
-        except Exception as e:
-            self.logger.error(f"Context generation failed: {str(e)}")
-            return chunk[-500:]  # Fallback to using last 500 chars
\ No newline at end of file
+        prompt = _CHUNK_SUMMARY.format(chunk_text=chunk)
+
+        if self.rate_limiter:
+            self.rate_limiter.acquire()
+        response = self.client.chat.completions.create(
+            messages=[{
+                "role": "user",
+                "content": prompt
+            }],
+            model=MODEL
+        )
+
+        return response.choices[0].message.content
+
+    def _extractive_summary(self, chunk: str, max_length: int = 600) -> str:
+        """
+        Summarize a chunk locally from its first and last sentences plus a few
+        in between that mention multi-word proper names.
+        """
+        sentences = [s.strip() for s in _SENTENCE_SPLIT_RE.split(chunk) if s.strip()]
+        if len(sentences) > 2:
+            key_sentences = [s for s in sentences[1:-1] if _TITLE_PHRASE_RE.search(s)][:3]
+            sentences = [sentences[0], *key_sentences, sentences[-1]]
+        
+        return " ".join(sentences)[:max_length]
+
+    def add_summary(self, summary: str) -> str:
+        """Append a chunk summary to the history and return the joined context"""
+        self.context_history.append(summary)
+        return " ".join(self.context_history)
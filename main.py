@@ -1,20 +1,32 @@
 import os
-import PyPDF2
-import pandas as pd
+import pypdfium2 as pdfium
 import gradio as gr
-from typing import List, Dict, Union, Optional
+import httpx
+from groq import Groq
+from typing import List, Dict, Union, Optional, Tuple, Iterator
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+from itertools import islice
 import logging
 from datetime import datetime
-import json
+import csv
+import orjson
 from agents import (
     TextProcessingAgent,
     QAGenerationAgent,
     ValidationAgent,
     ContextManager,
-    QAPair
+    QAPair,
+    LLMCache,
+    InMemoryCacheBackend,
+    SQLiteCacheBackend,
+    RateLimiter
 )
 
+# Characters read per block when streaming text files
+READ_BLOCK_SIZE = 64 * 1024
+
 class DatasetGenerator:
     def __init__(self, api_key: str, output_dir: str = "output"):
         """
@@ -27,16 +39,45 @@ class DatasetGenerator:
         # Setup logging
         self.setup_logging()
         
-        # Initialize agents
-        self.text_processor = TextProcessingAgent()
-        self.qa_generator = QAGenerationAgent(api_key)
-        self.validator = ValidationAgent(api_key)
-        self.context_manager = ContextManager(api_key)
-        
         # Setup output directory
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(exist_ok=True)
         
+        # Setup response cache (persistent unless QA_CACHE_PATH is empty)
+        cache_path = os.getenv("QA_CACHE_PATH", str(self.output_dir / "llm_cache.sqlite3"))
+        self.cache = LLMCache(
+            SQLiteCacheBackend(cache_path) if cache_path else InMemoryCacheBackend()
+        )
+        
+        # One client shares a keep-alive connection pool across all agents
+        self._groq = Groq(
+            api_key=api_key,
+            http_client=httpx.Client(
+                limits=httpx.Limits(max_connections=32, max_keepalive_connections=32),
+                timeout=60.0
+            )
+        )
+        
+        # Shared limit on request starts per minute (disabled when set to 0)
+        rpm = int(os.getenv("QA_RATE_LIMIT_RPM", 100))
+        self.rate_limiter = RateLimiter(rpm) if rpm > 0 else None
+        
+        # Initialize agents
+        self.text_processor = TextProcessingAgent()
+        self.qa_generator = QAGenerationAgent(
+            self._groq, cache=self.cache, rate_limiter=self.rate_limiter
+        )
+        self.validator = ValidationAgent(
+            self._groq, cache=self.cache, rate_limiter=self.rate_limiter
+        )
+        self.context_manager = ContextManager(self._groq, rate_limiter=self.rate_limiter)
+        
+        # Number of concurrent API requests
+        self.max_workers = int(os.getenv("QA_CONCURRENCY", 8))
+        
+        # Number of QA pairs sent per validation request
+        self.validation_batch_size = 50
+        
         # Initialize state
         self.current_session = datetime.now().strftime("%Y%m%d_%H%M%S")
         self.stats = {
@@ -45,42 +86,53 @@ class DatasetGenerator:
             "failed_chunks": 0,
             "validation_stats": {
                 "high_confidence": 0,
-                "low_confidence": 0
+                "low_confidence": 0,
+                "unscored": 0,
+                "rejected": 0
+            },
+            "cache_stats": {
+                "hits": 0,
+                "misses": 0
             }
         }
 
     def setup_logging(self):
         """Configure logging settings"""
+        # Progress goes to the console; the log file only records problems
+        file_handler = logging.FileHandler(f'dataset_generator_{datetime.now():%Y%m%d}.log')
+        file_handler.setLevel(logging.WARNING)
+        
         logging.basicConfig(
             level=logging.INFO,
             format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
             handlers=[
                 logging.StreamHandler(),
-                logging.FileHandler(f'dataset_generator_{datetime.now():%Y%m%d}.log')
+                file_handler
             ]
         )
         self.logger = logging.getLogger(__name__)
 
-    def extract_text_from_pdf(self, pdf_path: Union[str, Path]) -> str:
+    def iter_pdf_pages(self, pdf_path: Union[str, Path]) -> Iterator[str]:
         """
-        Extract text content from a PDF file.
+        Lazily extract text from a PDF file one page at a time.
         
         Args:
             pdf_path: Path to the PDF file
             
-        Returns:
-            str: Extracted text content
+        Yields:
+            str: Text content of each page
         """
-        text = ""
+        pdf = pdfium.PdfDocument(str(pdf_path))
         try:
-            with open(pdf_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                for page in pdf_reader.pages:
-                    text += page.extract_text()
-            return text
-        except Exception as e:
-            self.logger.error(f"Error reading PDF: {str(e)}")
-            raise
+            for page in pdf:
+                textpage = page.get_textpage()
+                # PDFium ends lines with \r\n; normalize so paragraph breaks are found
+                text = textpage.get_text_range().replace('\r\n', '\n')
+                textpage.close()
+                page.close()
+                yield text
+        finally:
+            pdf.close()
 
     def save_qa_pairs(self, qa_pairs: List[QAPair], filename: str):
         """
@@ -90,19 +142,39 @@ class DatasetGenerator:
             qa_pairs: List of QA pairs to save
             filename: Base filename for output
         """
-        # Save as CSV
-        csv_path = self.output_dir / f"{filename}.csv"
-        df = pd.DataFrame([
+        no_metadata = {}
+        rows = [
             {
                 'question': pair.question,
                 'answer': pair.answer,
                 'confidence': pair.confidence,
-                'metadata': json.dumps(pair.metadata or {})
+                'metadata': pair.metadata or no_metadata
             }
             for pair in qa_pairs
-        ])
+        ]
         
-        df.to_csv(csv_path, index=False)
+        # Pairs usually share one metadata dict, so serialize each distinct
+        # dict once; ids stay unique while rows keeps them all alive
+        metadata_json: Dict[int, str] = {}
+        for row in rows:
+            metadata = row['metadata']
+            if id(metadata) not in metadata_json:
+                metadata_json[id(metadata)] = orjson.dumps(metadata).decode('utf-8')
+        
+        # Save as CSV
+        csv_path = self.output_dir / f"{filename}.csv"
+        with open(csv_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['question', 'answer', 'confidence', 'metadata'])
+            writer.writerows(
+                (
+                    row['question'],
+                    row['answer'],
+                    row['confidence'],
+                    metadata_json[id(row['metadata'])]
+                )
+                for row in rows
+            )
         
         # Save detailed JSON
         json_path = self.output_dir / f"{filename}_detailed.json"
@@ -111,25 +183,132 @@ class DatasetGenerator:
                 'timestamp': datetime.now().isoformat(),
                 'stats': self.stats
             },
-            'qa_pairs': [
-                {
-                    'question': pair.question,
-                    'answer': pair.answer,
-                    'confidence': pair.confidence,
-                    'metadata': pair.metadata
-                }
-                for pair in qa_pairs
-            ]
+            'qa_pairs': rows
         }
         
-        with open(json_path, 'w', encoding='utf-8') as f:
-            json.dump(json_data, f, indent=2, ensure_ascii=False)
+        with open(json_path, 'wb') as f:
+            f.write(orjson.dumps(json_data, option=orjson.OPT_INDENT_2))
+
+    def _summarize_chunk(self, chunk: str) -> Optional[str]:
+        """Summarize a chunk for the next chunk's context, or None on failure"""
+        try:
+            return self.context_manager.summarize_chunk(chunk)
+        except Exception as e:
+            self.logger.error("Context generation failed: %s", e)
+            return None
+
+    def _process_chunk(self, 
+                       idx: int, 
+                       chunk: str, 
+                       context: Optional[str],
+                       overlap_prefix: Optional[str]) -> Tuple[int, List[QAPair]]:
+        """
+        Generate QA pairs for a single chunk.
+        
+        Args:
+            idx: 1-based index of the chunk
+            chunk: Chunk text
+            context: Context from the preceding chunks
+            overlap_prefix: Tail of the previous chunk, passed as context only
+            
+        Returns:
+            Tuple[int, List[QAPair]]: Chunk index and its generated QA pairs
+        """
+        self.logger.info("Processing chunk %d", idx)
+        return idx, self.qa_generator.generate_qa_pairs(chunk, context, overlap_prefix)
+
+    def _generate_pairs(self, chunks: Iterator[str]) -> List[QAPair]:
+        """
+        Generate QA pairs for a stream of chunks, a window at a time.
+        
+        Args:
+            chunks: Chunks in document order
+            
+        Returns:
+            List[QAPair]: Generated QA pairs in document order
+        """
+        overlap = self.text_processor.overlap
+        window_size = self.max_workers * 4
+        all_qa_pairs = []
+        prev_chunk = None
+        
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while True:
+                window = list(islice(chunks, window_size))
+                if not window:
+                    break
+                
+                first_idx = self.stats['total_chunks'] + 1
+                self.stats['total_chunks'] += len(window)
+                
+                # Each chunk's context comes from the chunks before it, which
+                # for the first chunk of a window means the previous window
+                preceding = window[:-1] if prev_chunk is None else [prev_chunk] + window[:-1]
+                contexts = [None] if prev_chunk is None else []
+                overlap_prefixes = [None] if prev_chunk is None else []
+                prev_chunk = window[-1]
+                
+                # Summaries are independent per chunk, so fetch them concurrently
+                # and rebuild the rolling context for each chunk in order
+                for chunk, summary in zip(preceding, executor.map(self._summarize_chunk, preceding)):
+                    if summary is None:
+                        contexts.append(chunk[-500:])  # Fallback to using last 500 chars
+                    else:
+                        contexts.append(self.context_manager.add_summary(summary))
+                    # Tail of the previous chunk, sent as a hint rather than content
+                    overlap_prefixes.append(chunk[-overlap:] if overlap else None)
+                
+                # Process chunks and generate QA pairs
+                results = {}
+                futures = {
+                    executor.submit(self._process_chunk, i, chunk, context, prefix): i
+                    for i, (chunk, context, prefix) in enumerate(
+                        zip(window, contexts, overlap_prefixes), first_idx
+                    )
+                }
+                for future in as_completed(futures):
+                    i = futures[future]
+                    try:
+                        idx, qa_pairs = future.result()
+                        results[idx] = qa_pairs
+                    except Exception as e:
+                        self.logger.error("Error processing chunk %d: %s", i, e)
+                        self.stats['failed_chunks'] += 1
+                
+                for i in sorted(results):
+                    all_qa_pairs.extend(results[i])
+        
+        return all_qa_pairs
+
+    def _validate_pairs(self, qa_pairs: List[QAPair]) -> List[QAPair]:
+        """
+        Validate QA pairs in batches spread across concurrent requests.
+        
+        Args:
+            qa_pairs: QA pairs generated for the whole document
+            
+        Returns:
+            List[QAPair]: Validated QA pairs in their original order
+        """
+        batches = [
+            qa_pairs[i:i + self.validation_batch_size]
+            for i in range(0, len(qa_pairs), self.validation_batch_size)
+        ]
+        
+        validated_pairs = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for batch in executor.map(self.validator.validate_qa_pairs, batches):
+                validated_pairs.extend(batch)
+        
+        return validated_pairs
 
     def process_document(self, 
                         input_path: Union[str, Path], 
                         is_pdf: bool = True,
                         chunk_size: int = 2000,
-                        overlap: int = 200) -> str:
+                        overlap: int = 200,
+                        validate: bool = False,
+                        llm_context: bool = False) -> str:
         """
         Process a document and generate QA pairs.
         
@@ -137,54 +316,48 @@ class DatasetGenerator:
             input_path: Path to input document
             is_pdf: Whether the input is a PDF file
             chunk_size: Size of text chunks
-            overlap: Overlap between chunks
+            overlap: Characters of preceding text given as context to each chunk
+            validate: Whether to also score QA pairs with the LLM validator
+            llm_context: Whether to summarize chunks for context with the LLM
+                instead of locally (always used for chunks over 4000 characters)
             
         Returns:
             str: Status message
         """
         try:
-            # Extract text
-            self.logger.info(f"Processing document: {input_path}")
+            # Stream chunks from the document without loading it whole
+            self.logger.info("Processing document: %s", input_path)
+            self.text_processor = TextProcessingAgent(chunk_size, overlap)
+            self.context_manager.use_llm = llm_context or chunk_size > 4000
             if is_pdf:
-                text = self.extract_text_from_pdf(input_path)
+                pages = (page + "\n" for page in self.iter_pdf_pages(input_path))
+                all_qa_pairs = self._generate_pairs(self.text_processor.iter_chunks(pages))
             else:
                 with open(input_path, 'r', encoding='utf-8') as f:
-                    text = f.read()
-
-            # Create chunks
-            chunks = self.text_processor.create_chunks(text)
-            self.stats['total_chunks'] = len(chunks)
+                    blocks = iter(partial(f.read, READ_BLOCK_SIZE), "")
+                    all_qa_pairs = self._generate_pairs(self.text_processor.iter_chunks(blocks))
             
-            # Process chunks and generate QA pairs
-            all_qa_pairs = []
-            context = None
+            # Drop obviously broken pairs locally
+            filtered_pairs = self.validator.filter_qa_pairs(all_qa_pairs)
+            self.stats['validation_stats']['rejected'] += len(all_qa_pairs) - len(filtered_pairs)
+            all_qa_pairs = filtered_pairs
             
-            for i, chunk in enumerate(chunks, 1):
-                self.logger.info(f"Processing chunk {i}/{len(chunks)}")
-                
-                try:
-                    # Generate QA pairs
-                    qa_pairs = self.qa_generator.generate_qa_pairs(chunk, context)
-                    
-                    # Validate QA pairs
-                    validated_pairs = self.validator.validate_qa_pairs(qa_pairs)
-                    
-                    # Update statistics
-                    self.stats['total_qa_pairs'] += len(validated_pairs)
-                    for pair in validated_pairs:
-                        if pair.confidence > 0.8:
-                            self.stats['validation_stats']['high_confidence'] += 1
-                        else:
-                            self.stats['validation_stats']['low_confidence'] += 1
-                    
-                    all_qa_pairs.extend(validated_pairs)
-                    
-                    # Update context for next chunk
-                    context = self.context_manager.update_context(chunk)
-                    
-                except Exception as e:
-                    self.logger.error(f"Error processing chunk {i}: {str(e)}")
-                    self.stats['failed_chunks'] += 1
+            # Validate QA pairs
+            if validate:
+                all_qa_pairs = self._validate_pairs(all_qa_pairs)
+            
+            # Update statistics
+            self.stats['total_qa_pairs'] += len(all_qa_pairs)
+            for pair in all_qa_pairs:
+                if pair.confidence is None:
+                    self.stats['validation_stats']['unscored'] += 1
+                elif pair.confidence > 0.8:
+                    self.stats['validation_stats']['high_confidence'] += 1
+                else:
+                    self.stats['validation_stats']['low_confidence'] += 1
+            
+            self.stats['cache_stats']['hits'] = self.cache.hits
+            self.stats['cache_stats']['misses'] = self.cache.misses
             
             # Save results
             filename = f"dataset_{self.current_session}"
@@ -197,7 +370,11 @@ class DatasetGenerator:
                 f"- Generated QA pairs: {self.stats['total_qa_pairs']}\n"
                 f"- High confidence pairs: {self.stats['validation_stats']['high_confidence']}\n"
                 f"- Low confidence pairs: {self.stats['validation_stats']['low_confidence']}\n"
+                f"- Unscored pairs: {self.stats['validation_stats']['unscored']}\n"
+                f"- Rejected pairs: {self.stats['validation_stats']['rejected']}\n"
                 f"- Failed chunks: {self.stats['failed_chunks']}\n"
+                f"- Cache hits: {self.stats['cache_stats']['hits']}/"
+                f"{self.stats['cache_stats']['hits'] + self.stats['cache_stats']['misses']}\n"
                 f"Output saved to {filename}.csv and {filename}_detailed.json"
             )
             
@@ -216,7 +393,9 @@ def create_gradio_interface():
                     file: Union[str, Path], 
                     is_pdf: bool,
                     chunk_size: int,
-                    overlap: int) -> str:
+                    overlap: int,
+                    validate: bool,
+                    llm_context: bool) -> str:
         if not api_key:
             return "Please provide a Groq API key."
         
@@ -225,7 +404,9 @@ def create_gradio_interface():
             file.name,
             is_pdf=is_pdf,
             chunk_size=chunk_size,
-            overlap=overlap
+            overlap=overlap,
+            validate=validate,
+            llm_context=llm_context
         )
 
     # Create the interface
@@ -260,7 +441,17 @@ def create_gradio_interface():
                 maximum=500,
                 value=200,
                 step=50,
-                info="Number of overlapping characters between chunks"
+                info="Number of preceding characters given to each chunk as context"
+            ),
+            gr.Checkbox(
+                label="LLM Validation",
+                value=False,
+                info="Score QA pairs with an extra LLM pass (slower, uses more API calls)"
+            ),
+            gr.Checkbox(
+                label="LLM Context Summaries",
+                value=False,
+                info="Summarize each chunk with the LLM for context instead of locally (slower, uses more API calls)"
             )
         ],
         outputs=gr.Textbox(
@@ -274,7 +465,7 @@ This tool will:
 1. Process your document (PDF or text)
 2. Split it into manageable chunks
 3. Generate high-quality QA pairs
-4. Validate the generated pairs
+4. Filter the generated pairs (optionally validating them with the LLM)
 5. Save the results in CSV and JSON formats""",
         theme="default"
     )
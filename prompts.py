@@ -1,3 +1,24 @@
+from string import Formatter
+
+
+class PromptTemplate:
+    """A str.format template pre-split into literal segments and field names"""
+
+    def __init__(self, template: str):
+        self._segments = [
+            (literal, field)
+            for literal, field, _, _ in Formatter().parse(template)
+        ]
+
+    def format(self, **values: str) -> str:
+        parts = []
+        for literal, field in self._segments:
+            parts.append(literal)
+            if field is not None:
+                parts.append(values[field])
+        return "".join(parts)
+
+
 class Prompts:
     QA_GENERATION = """You are a specialized AI trained to create high-quality question-answer pairs for training data.
 
@@ -15,25 +36,28 @@ Instructions:
 {context_instruction}
 
 Output Format Requirements:
-- Each pair MUST start with 'Q1:', 'Q2:', or 'Q3:' for questions
-- Each answer MUST start with 'A1:', 'A2:', or 'A3:' respectively
-- Questions and answers MUST alternate (Q1, A1, Q2, A2, Q3, A3)
+- Return a single JSON object with a "pairs" array
+- Each element MUST be an object with a "q" key for the question and an "a" key for the answer
 - Questions and answers MUST NOT be empty
-- DO NOT include any additional formatting or text
+- DO NOT include any text outside the JSON object
 
 Example Format:
-Q1: What is the main concept discussed in the text?
-A1: The main concept is...
-Q2: How does the text explain...?
-A2: The text explains this by...
-Q3: What are the key implications of...?
-A3: The key implications are..."""
+{{"pairs": [
+  {{"q": "What is the main concept discussed in the text?", "a": "The main concept is..."}},
+  {{"q": "How does the text explain...?", "a": "The text explains this by..."}},
+  {{"q": "What are the key implications of...?", "a": "The key implications are..."}}
+]}}"""
 
     CONTEXT_INSTRUCTION = """
 Previous Context:
 {context}
 Consider this context while generating questions to maintain continuity and avoid repetition."""
 
+    OVERLAP_INSTRUCTION = """
+Preceding Text:
+{overlap_text}
+This text directly precedes the content and is already covered elsewhere. Use it only to understand the content; do not create questions from it."""
+
     CHUNK_SUMMARY = """Create a brief summary of the following content that captures the key points and context. This will be used to maintain continuity between chunks.
 
 Content:
@@ -46,7 +70,9 @@ Keep the summary focused on main ideas that might be relevant for the next secti
 Content:
 {text_content}
 
-{context_instruction}"""
+{context_instruction}
+
+Return a single JSON object of the form {{"pairs": [{{"q": "question", "a": "answer"}}]}} and nothing else."""
 
     VALIDATION = """Please validate the following question-answer pairs for quality and relevance:
 
@@ -57,6 +83,5 @@ For each pair, verify:
 2. Answer accuracy and completeness
 3. Relevance to the source material
 
-Provide feedback in the following format:
-VALID: [true/false]
-FEEDBACK: [specific issues if any]"""
\ No newline at end of file
+Provide feedback for every pair on its own line in the following format:
+INDEX: [pair index], VALID: [true/false], FEEDBACK: [specific issues if any]"""
\ No newline at end of file
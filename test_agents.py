@@ -0,0 +1,153 @@
+import random
+from types import SimpleNamespace
+
+import groq
+import httpx
+import pytest
+
+import agents
+from agents import QAGenerationAgent, QAPair, TextProcessingAgent, ValidationAgent
+
+
+def _blocks(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+class FakeClient:
+    """Stands in for the Groq client, replaying errors or reply contents in order"""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=self)
+
+    def with_options(self, **kwargs):
+        return self
+
+    def create(self, **kwargs):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        message = SimpleNamespace(content=outcome)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+def _status_error(error_cls, status_code):
+    request = httpx.Request("POST", "https://api.groq.com/openai/v1/chat/completions")
+    response = httpx.Response(status_code, request=request)
+    return error_cls(f"HTTP {status_code}", response=response, body=None)
+
+
+def test_iter_chunks_handles_runs_of_blank_lines():
+    processor = TextProcessingAgent(chunk_size=20, overlap=5)
+    text = "alpha\n\n\n\nbeta gamma delta\n\n\n\n\nepsilon zeta eta theta" * 5
+
+    expected = processor.create_chunks(text)
+    for size in (1, 2, 3, 64):
+        assert list(processor.iter_chunks(_blocks(text, size))) == expected
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_iter_chunks_matches_create_chunks(seed):
+    rng = random.Random(seed)
+    words = ["alpha", "beta. ", "gamma\n", "\n\n", "\n\n\n", "\n\n\n\n\n", " ", "x" * 13]
+
+    for _ in range(50):
+        processor = TextProcessingAgent(chunk_size=rng.choice([10, 23, 50, 200]), overlap=5)
+        text = "".join(rng.choice(words) for _ in range(rng.randint(0, 400)))
+
+        expected = processor.create_chunks(text)
+        for size in (1, 7, 4096):
+            assert list(processor.iter_chunks(_blocks(text, size))) == expected
+
+
+def test_filter_qa_pairs_drops_low_quality_pairs():
+    validator = ValidationAgent(client=None)
+    kept = QAPair("What is the capital of France?", "It is Paris, which is also its largest city.")
+    pairs = [
+        kept,
+        QAPair("What is the capital of France?", "Paris"),  # Answer too short
+        QAPair("Name the capital of France", "Paris is the capital of France."),  # No '?'
+        QAPair("Is Paris the capital of France?", "Is Paris the capital of France"),  # Echo
+    ]
+
+    assert validator.filter_qa_pairs(pairs) == [kept]
+    assert kept.confidence is None
+
+
+def test_generate_qa_pairs_does_not_retry_client_errors(monkeypatch):
+    monkeypatch.setattr(agents.time, "sleep", lambda seconds: None)
+    client = FakeClient(_status_error(groq.AuthenticationError, 401))
+
+    assert QAGenerationAgent(client).generate_qa_pairs("Some text") == []
+    assert client.calls == 1
+
+
+def test_generate_qa_pairs_retries_rate_limits(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(agents.time, "sleep", sleeps.append)
+    client = FakeClient(
+        _status_error(groq.RateLimitError, 429),
+        '{"pairs": [{"q": "What is it?", "a": "It is a test."}]}',
+    )
+
+    pairs = QAGenerationAgent(client).generate_qa_pairs("Some text")
+
+    assert [(pair.question, pair.answer) for pair in pairs] == [("What is it?", "It is a test.")]
+    assert client.calls == 2
+    assert len(sleeps) == 1
+
+
+def test_validate_qa_pairs_marks_failed_batches_unverified():
+    pair = QAPair("What is it?", "It is a test.")
+    client = FakeClient(_status_error(groq.InternalServerError, 500))
+
+    ValidationAgent(client).validate_qa_pairs([pair])
+
+    assert pair.confidence == 0.5
+
+
+def test_parse_verdicts_reads_each_index():
+    feedback = (
+        "INDEX: 1, VALID: true, FEEDBACK: none\n"
+        "index: 2 , valid: FALSE, FEEDBACK: answer is wrong\n"
+        "Some commentary that is not a verdict"
+    )
+
+    assert ValidationAgent._parse_verdicts(feedback) == {1: True, 2: False}
+
+
+def test_apply_validation_feedback_scores_pairs_individually():
+    pairs = [QAPair(f"Question {i}?", f"Answer number {i}.") for i in range(3)]
+
+    ValidationAgent(client=None)._apply_validation_feedback(pairs, {1: True, 2: False})
+
+    # The third pair is not mentioned in the reply, so it stays unverified
+    assert [pair.confidence for pair in pairs] == [1.0, 0.5, 0.5]
+
+
+def test_validate_qa_pairs_sends_one_request_per_batch():
+    pairs = [QAPair(f"Question {i}?", f"Answer number {i}.") for i in range(3)]
+    client = FakeClient("INDEX: 1, VALID: true\nINDEX: 2, VALID: false\nINDEX: 3, VALID: true")
+
+    ValidationAgent(client).validate_qa_pairs(pairs)
+
+    assert client.calls == 1
+    assert [pair.confidence for pair in pairs] == [1.0, 0.5, 1.0]
+
+
+def test_parse_qa_response_skips_null_and_non_string_values():
+    response = (
+        '{"pairs": ['
+        '{"q": "What is it?", "a": " It is a test. "},'
+        '{"q": null, "a": "Orphan answer."},'
+        '{"q": "How many?", "a": 42},'
+        '{"q": "", "a": "Empty question."},'
+        '"not a pair"'
+        ']}'
+    )
+
+    pairs = QAGenerationAgent(FakeClient())._parse_qa_response(response)
+
+    assert [(pair.question, pair.answer) for pair in pairs] == [("What is it?", "It is a test.")]